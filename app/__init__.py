@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, jsonify, render_template, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
@@ -6,21 +6,44 @@ from flask_wtf.csrf import CSRFProtect
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_talisman import Talisman
+from argon2 import PasswordHasher
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
 from config import config
+from concurrent.futures import ThreadPoolExecutor
 import os
+import sqlite3
 
 # Initialize extensions
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 login_manager = LoginManager()
 csrf = CSRFProtect()
-limiter = Limiter(
-    key_func=get_remote_address,
-    default_limits=["200 per day", "50 per hour"],
-    storage_uri="memory://"
-)
+# Default limits, storage backend and strategy come from RATELIMIT_DEFAULT,
+# RATELIMIT_STORAGE_URI and RATELIMIT_STRATEGY
+limiter = Limiter(key_func=get_remote_address)
 talisman = Talisman()
 
+# Bounded pool for password hashing; the bcrypt and argon2 C code releases
+# the GIL, so verifications run in parallel up to the number of cores
+bcrypt_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='bcrypt')
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    """
+    Run SQLite in WAL mode so failed-login writes do not block concurrent
+    login reads. Other databases are left untouched.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA temp_store=MEMORY')
+    cursor.execute('PRAGMA mmap_size=268435456')
+    cursor.close()
+
 
 def create_app(config_name=None):
     """
@@ -33,11 +56,17 @@ def create_app(config_name=None):
 
     app = Flask(__name__)
     app.config.from_object(config[config_name])
+    config[config_name].init_app(app)
 
     # Initialize extensions with app
     db.init_app(app)
     bcrypt.init_app(app)
     csrf.init_app(app)
+    app.extensions['argon2'] = PasswordHasher(
+        time_cost=app.config['ARGON2_TIME_COST'],
+        memory_cost=app.config['ARGON2_MEMORY_COST'],
+        parallelism=app.config['ARGON2_PARALLELISM']
+    )
 
     # Configure Flask-Login
     login_manager.init_app(app)
@@ -56,22 +85,53 @@ def create_app(config_name=None):
             force_https=app.config['TALISMAN_FORCE_HTTPS'],
             strict_transport_security=app.config['TALISMAN_STRICT_TRANSPORT_SECURITY'],
             strict_transport_security_max_age=app.config['TALISMAN_STRICT_TRANSPORT_SECURITY_MAX_AGE'],
-            content_security_policy=app.config['TALISMAN_CONTENT_SECURITY_POLICY']
+            content_security_policy=None  # Set below from a prebuilt header
         )
 
+        # Serialize the CSP once instead of on every response
+        csp_header = '; '.join(
+            '{} {}'.format(directive, sources if isinstance(sources, str) else ' '.join(sources))
+            for directive, sources in app.config['TALISMAN_CONTENT_SECURITY_POLICY'].items()
+        )
+
+        @app.after_request
+        def set_content_security_policy(response):
+            response.headers.setdefault('Content-Security-Policy', csp_header)
+            return response
+
     # Register blueprints
     from app.routes import auth, api, main
     app.register_blueprint(auth.bp)
     app.register_blueprint(api.bp)
     app.register_blueprint(main.bp)
 
-    # Create database tables
-    with app.app_context():
+    # Write queued API key usage in the background
+    from app.usage import init_usage_flusher
+    init_usage_flusher(app)
+
+    # Schema introspection is skipped unless enabled (development/testing);
+    # production runs `flask init-admin` once at deploy instead
+    if app.config.get('AUTO_CREATE_TABLES', False):
+        with app.app_context():
+            db.create_all()
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db():
+        """Create missing tables and apply in-place schema upgrades."""
+        from app.schema import upgrade_schema
         db.create_all()
+        for change in upgrade_schema():
+            print(f'Schema upgrade: {change}')
 
-        # Create default admin user if it doesn't exist
+    @app.cli.command('init-admin')
+    def init_admin():
+        """Create or upgrade database tables and the default admin user."""
         from app.models import User
-        admin = User.query.filter_by(username='admin').first()
+        from app.schema import upgrade_schema
+        db.create_all()
+        for change in upgrade_schema():
+            print(f'Schema upgrade: {change}')
+        admin = db.session.scalar(select(User).where(User.username == 'admin').limit(1))
         if not admin:
             admin = User(
                 username='admin',
@@ -82,24 +142,22 @@ def create_app(config_name=None):
             db.session.add(admin)
             db.session.commit()
             print('Default admin user created. Please change the password!')
+        else:
+            print('Admin user already exists.')
 
     # Error handlers
     @app.errorhandler(404)
     def not_found_error(error):
-        from flask import render_template
         return render_template('errors/404.html'), 404
 
     @app.errorhandler(500)
     def internal_error(error):
-        from flask import render_template
         db.session.rollback()
         return render_template('errors/500.html'), 500
 
     @app.errorhandler(429)
     def ratelimit_handler(e):
-        from flask import render_template, request
         if request.path.startswith('/api/'):
-            from flask import jsonify
             return jsonify(error="Rate limit exceeded", message=str(e.description)), 429
         return render_template('errors/429.html'), 429
 
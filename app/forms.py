@@ -1,10 +1,34 @@
+from flask_login import current_user
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField
 from wtforms.validators import (
     DataRequired, Email, EqualTo, Length, ValidationError, Regexp
 )
+from sqlalchemy import or_, select
+from app import db
 from app.models import User
-import re
+import string
+
+# Character-class bits for PasswordValidator
+_UPPER, _LOWER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+_SPECIAL_CHARS = set('!@#$%^&*(),.?":{}|<>')
+
+
+def _build_class_table():
+    """Map every byte value to its character-class bits"""
+    table = bytearray(256)
+    for ch in string.ascii_uppercase:
+        table[ord(ch)] = _UPPER
+    for ch in string.ascii_lowercase:
+        table[ord(ch)] = _LOWER
+    for ch in string.digits:
+        table[ord(ch)] = _DIGIT
+    for ch in _SPECIAL_CHARS:
+        table[ord(ch)] = _SPECIAL
+    return bytes(table)
+
+
+_CLASS = _build_class_table()
 
 
 class PasswordValidator:
@@ -20,16 +44,21 @@ class PasswordValidator:
         if len(password) < self.min_length:
             errors.append(f'at least {self.min_length} characters')
 
-        if not re.search(r'[A-Z]', password):
+        # Map every byte to its class bits in C, then OR the few distinct values
+        mask = 0
+        for bits in set(password.encode('utf-8').translate(_CLASS)):
+            mask |= bits
+
+        if not mask & _UPPER:
             errors.append('at least one uppercase letter')
 
-        if not re.search(r'[a-z]', password):
+        if not mask & _LOWER:
             errors.append('at least one lowercase letter')
 
-        if not re.search(r'\d', password):
+        if not mask & _DIGIT:
             errors.append('at least one digit')
 
-        if not re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+        if not mask & _SPECIAL:
             errors.append('at least one special character')
 
         if errors:
@@ -87,21 +116,39 @@ class RegistrationForm(FlaskForm):
 
     submit = SubmitField('Register')
 
-    def validate_username(self, username):
-        """Check if username already exists"""
-        user = User.query.filter_by(username=username.data).first()
-        if user:
-            raise ValidationError(
-                'Username already taken. Please choose a different one.'
-            )
+    def validate(self, extra_validators=None):
+        """
+        Run field validators, then check availability of whichever of
+        username and email passed them, with a single query instead of one
+        per field. Password errors do not hide duplicate errors.
+        """
+        valid = super().validate(extra_validators)
+
+        username = None if self.username.errors else self.username.data
+        email = None if self.email.errors else self.email.data.lower()
+        conditions = []
+        if username is not None:
+            conditions.append(User.username == username)
+        if email is not None:
+            conditions.append(User.email == email)
+        if not conditions:
+            return valid
+
+        rows = db.session.execute(
+            select(User.username, User.email).where(or_(*conditions)).limit(2)
+        ).all()
+
+        for row in rows:
+            if username is not None and row.username == username:
+                self.username.errors.append(
+                    'Username already taken. Please choose a different one.'
+                )
+            if email is not None and row.email == email:
+                self.email.errors.append(
+                    'Email already registered. Please use a different email or login.'
+                )
 
-    def validate_email(self, email):
-        """Check if email already exists"""
-        user = User.query.filter_by(email=email.data.lower()).first()
-        if user:
-            raise ValidationError(
-                'Email already registered. Please use a different email or login.'
-            )
+        return valid and not rows
 
 
 class LoginForm(FlaskForm):
@@ -192,14 +239,12 @@ class ProfileUpdateForm(FlaskForm):
 
     submit = SubmitField('Update Profile')
 
-    def __init__(self, original_email, *args, **kwargs):
-        super(ProfileUpdateForm, self).__init__(*args, **kwargs)
-        self.original_email = original_email
-
     def validate_email(self, email):
         """Check if email is already taken by another user"""
-        if email.data.lower() != self.original_email.lower():
-            user = User.query.filter_by(email=email.data.lower()).first()
+        if email.data.lower() != current_user.email:
+            user = db.session.scalar(
+                select(User.id).where(User.email == email.data.lower()).limit(1)
+            )
             if user:
                 raise ValidationError(
                     'Email already registered. Please use a different email.'
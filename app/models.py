@@ -1,13 +1,79 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from flask import current_app
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from app import db, bcrypt, login_manager
+from argon2.exceptions import InvalidHashError, VerificationError
+from sqlalchemy import case, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import validates
+from sqlalchemy.sql.expression import FunctionElement
+from app import db, bcrypt, bcrypt_pool, login_manager
+
+
+class utcnow(FunctionElement):
+    """
+    Current UTC time from the database clock, as a naive timestamp.
+    Timestamps set in Python use datetime.utcnow(), so database-side
+    timestamps must be UTC too, whatever the session time zone.
+    """
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    # SQLite's CURRENT_TIMESTAMP is always UTC
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, 'mysql')
+def _utcnow_mysql(element, compiler, **kw):
+    return 'UTC_TIMESTAMP()'
+
+
+@compiles(utcnow, 'mssql')
+def _utcnow_mssql(element, compiler, **kw):
+    return 'GETUTCDATE()'
+
+
+# Entropy read from os.urandom in 4 KiB blocks and consumed by _token_urlsafe
+_entropy_buf = bytearray()
+_entropy_lock = threading.Lock()
+
+
+def _reset_entropy():
+    """Discard buffered entropy so forked workers never share bytes"""
+    global _entropy_lock
+    _entropy_lock = threading.Lock()
+    _entropy_buf.clear()
+
+
+os.register_at_fork(after_in_child=_reset_entropy)
+
+
+def _token_urlsafe(nbytes):
+    """secrets.token_urlsafe() equivalent that amortizes the urandom syscall"""
+    with _entropy_lock:
+        if len(_entropy_buf) < nbytes:
+            _entropy_buf.extend(os.urandom(4096))
+        chunk = bytes(_entropy_buf[:nbytes])
+        del _entropy_buf[:nbytes]
+    return base64.urlsafe_b64encode(chunk).rstrip(b'=').decode('ascii')
 
 
 @login_manager.user_loader
 def load_user(user_id):
     """Load user by ID for Flask-Login"""
-    return User.query.get(int(user_id))
+    return db.session.get(User, int(user_id))
 
 
 class User(UserMixin, db.Model):
@@ -15,6 +81,10 @@ class User(UserMixin, db.Model):
 
     __tablename__ = 'users'
 
+    # Lock account after this many failed attempts, for this long
+    MAX_FAILED_LOGINS = 5
+    LOCKOUT_DURATION = timedelta(minutes=30)
+
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
@@ -27,9 +97,11 @@ class User(UserMixin, db.Model):
     last_failed_login = db.Column(db.DateTime, nullable=True)
     account_locked_until = db.Column(db.DateTime, nullable=True)
 
-    # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Timestamps (set by the database clock in UTC, not computed in Python).
+    # default renders the expression inline in the INSERT so tables created
+    # without the server default keep working.
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow(), nullable=False)
+    updated_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())
     last_login = db.Column(db.DateTime, nullable=True)
 
     # Relationships
@@ -38,63 +110,147 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+    @validates('email')
+    def _normalize_email(self, key, email):
+        """Store emails lower-cased so lookups can use the plain unique index"""
+        return email.lower() if email else email
+
     def set_password(self, password):
         """
-        Hash and set the user's password using bcrypt.
+        Hash and set the user's password using Argon2id (or bcrypt when
+        PASSWORD_HASH_SCHEME is 'bcrypt').
         This is more secure than storing plain text passwords.
         """
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        if current_app.config['PASSWORD_HASH_SCHEME'] == 'argon2':
+            self.password_hash = current_app.extensions['argon2'].hash(password)
+        else:
+            self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
 
     def check_password(self, password):
         """
         Verify a password against the stored hash.
         Returns True if password matches, False otherwise.
+        Runs on the shared hashing pool to cap concurrent hashing at the core count.
+        Legacy bcrypt and outdated Argon2 hashes are rehashed with the current
+        scheme on success; the caller commits.
         """
-        return bcrypt.check_password_hash(self.password_hash, password)
+        if self.password_hash.startswith('$argon2'):
+            hasher = current_app.extensions['argon2']
+            try:
+                bcrypt_pool.submit(hasher.verify, self.password_hash, password).result()
+            except (VerificationError, InvalidHashError):
+                return False
+            needs_rehash = hasher.check_needs_rehash(self.password_hash)
+        else:
+            if not bcrypt_pool.submit(bcrypt.check_password_hash, self.password_hash, password).result():
+                return False
+            needs_rehash = current_app.config['PASSWORD_HASH_SCHEME'] == 'argon2'
+
+        if needs_rehash:
+            self.set_password(password)
+        return True
+
+    @staticmethod
+    def verify_password_for_unknown_user(password):
+        """
+        Spend the same hashing work as check_password when no user matched,
+        so response timing does not reveal whether an account exists.
+        Always returns False.
+        """
+        dummy_hash = current_app.extensions.get('dummy_password_hash')
+        if dummy_hash is None:
+            dummy = User()
+            dummy.set_password(_token_urlsafe(16))
+            dummy_hash = current_app.extensions['dummy_password_hash'] = dummy.password_hash
+        User(password_hash=dummy_hash).check_password(password)
+        return False
 
     def is_account_locked(self):
-        """Check if account is currently locked due to failed login attempts"""
-        if self.account_locked_until:
-            if datetime.utcnow() < self.account_locked_until:
-                return True
-            else:
-                # Unlock account if lock period has expired
-                self.account_locked_until = None
-                self.failed_login_attempts = 0
-                db.session.commit()
+        """
+        Check if account is currently locked due to failed login attempts.
+        An expired lock is cleared in the session; the caller commits.
+        """
+        if not self.account_locked_until:
+            return False
+
+        if datetime.utcnow() < self.account_locked_until:
+            return True
+
+        # Unlock account if lock period has expired
+        self.account_locked_until = None
+        self.failed_login_attempts = 0
         return False
 
     def record_failed_login(self):
-        """Record a failed login attempt and lock account if necessary"""
+        """
+        Record a failed login attempt and lock account if necessary.
+        Changes are left in the session; the caller commits.
+        """
         self.failed_login_attempts += 1
-        self.last_failed_login = datetime.utcnow()
-
-        # Lock account after 5 failed attempts for 30 minutes
-        if self.failed_login_attempts >= 5:
-            from datetime import timedelta
-            self.account_locked_until = datetime.utcnow() + timedelta(minutes=30)
+        self.last_failed_login = utcnow()
 
-        db.session.commit()
+        # Lock account after too many failed attempts
+        if self.failed_login_attempts >= self.MAX_FAILED_LOGINS:
+            self.account_locked_until = datetime.utcnow() + self.LOCKOUT_DURATION
 
     def reset_failed_logins(self):
-        """Reset failed login attempts after successful login"""
+        """
+        Reset failed login attempts after successful login.
+        Changes are left in the session; the caller commits.
+        """
         self.failed_login_attempts = 0
         self.last_failed_login = None
         self.account_locked_until = None
-        self.last_login = datetime.utcnow()
-        db.session.commit()
+        self.last_login = utcnow()
+
+    @classmethod
+    def record_failed_login_fast(cls, user_id):
+        """
+        record_failed_login as a single atomic UPDATE ... WHERE id = :id.
+        The counter is incremented in SQL, so concurrent failures are not lost.
+        The caller commits.
+        """
+        attempts = cls.failed_login_attempts + 1
+        db.session.execute(
+            update(cls)
+            .where(cls.id == user_id)
+            .values(
+                failed_login_attempts=attempts,
+                last_failed_login=utcnow(),
+                account_locked_until=case(
+                    (attempts >= cls.MAX_FAILED_LOGINS,
+                     datetime.utcnow() + cls.LOCKOUT_DURATION),
+                    else_=cls.account_locked_until
+                )
+            )
+        )
+
+    @classmethod
+    def reset_failed_logins_fast(cls, user_id):
+        """reset_failed_logins as a single UPDATE ... WHERE id = :id. The caller commits."""
+        db.session.execute(
+            update(cls)
+            .where(cls.id == user_id)
+            .values(
+                failed_login_attempts=0,
+                last_failed_login=None,
+                account_locked_until=None,
+                last_login=utcnow()
+            )
+        )
 
     def to_dict(self, include_email=False):
         """
         Convert user to dictionary for API responses.
         Excludes sensitive information like password hash.
+        Datetimes are left for the JSON encoder (orjson) to format.
         """
         data = {
             'id': self.id,
             'username': self.username,
             'is_admin': self.is_admin,
-            'created_at': self.created_at.isoformat(),
-            'last_login': self.last_login.isoformat() if self.last_login else None
+            'created_at': self.created_at,
+            'last_login': self.last_login
         }
         if include_email:
             data['email'] = self.email
@@ -105,8 +261,13 @@ class ApiKey(db.Model):
     """API Key model for token-based authentication"""
 
     __tablename__ = 'api_keys'
+    __table_args__ = (
+        # Serves per-user listing and (user_id, is_active) filters
+        db.Index('ix_apikey_user_active', 'user_id', 'is_active'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
+    key_id = db.Column(db.String(16), unique=True, index=True)  # Public lookup prefix
     key_hash = db.Column(db.String(255), unique=True, nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -116,15 +277,37 @@ class ApiKey(db.Model):
     last_used = db.Column(db.DateTime, nullable=True)
 
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow(), nullable=False)
     expires_at = db.Column(db.DateTime, nullable=True)
 
     def __repr__(self):
         return f'<ApiKey {self.name}>'
 
+    def generate_key(self):
+        """
+        Generate a new key as "<key_id>.<secret>" and store its hash.
+        The plaintext key_id lets requests find their row with one indexed
+        lookup, so only a single hash verification is needed per request.
+        Returns the full key; it cannot be recovered afterwards.
+        """
+        self.key_id = _token_urlsafe(9)
+        secret = _token_urlsafe(32)
+        self.set_key(secret)
+        return f'{self.key_id}.{secret}'
+
+    @staticmethod
+    def _hash_key(key):
+        """
+        HMAC-SHA256 the key with the server-side pepper.
+        Keys are high-entropy random tokens, so a slow password KDF adds
+        request latency without adding security.
+        """
+        pepper = current_app.config['API_KEY_PEPPER'].encode('utf-8')
+        return hmac.new(pepper, key.encode('utf-8'), hashlib.sha256).hexdigest()
+
     def set_key(self, key):
         """Hash and store the API key"""
-        self.key_hash = generate_password_hash(key)
+        self.key_hash = self._hash_key(key)
 
     def verify_key(self, key):
         """Verify an API key against the stored hash"""
@@ -132,12 +315,7 @@ class ApiKey(db.Model):
             return False
         if self.expires_at and datetime.utcnow() > self.expires_at:
             return False
-        return check_password_hash(self.key_hash, key)
-
-    def record_usage(self):
-        """Record API key usage"""
-        self.last_used = datetime.utcnow()
-        db.session.commit()
+        return hmac.compare_digest(self.key_hash, self._hash_key(key))
 
     def to_dict(self):
         """Convert API key to dictionary (excluding sensitive hash)"""
@@ -145,7 +323,7 @@ class ApiKey(db.Model):
             'id': self.id,
             'name': self.name,
             'is_active': self.is_active,
-            'created_at': self.created_at.isoformat(),
-            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
-            'last_used': self.last_used.isoformat() if self.last_used else None
+            'created_at': self.created_at,
+            'expires_at': self.expires_at,
+            'last_used': self.last_used
         }
@@ -1,13 +1,82 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, request
 from flask_login import login_required, current_user
 from functools import wraps
+from datetime import datetime
+from cachetools import TTLCache
+from sqlalchemy import func, select
 from app import db, limiter
 from app.models import User, ApiKey
 from app.forms import ApiKeyForm
-import secrets
+from app.usage import record_usage
+import gzip
+import hashlib
+import orjson
+import threading
 
 bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Resolved API keys: blake2b(raw key) -> (key pk, user id, expires_at).
+# Revocation evicts locally; other worker processes see it within the TTL.
+_key_cache = TTLCache(maxsize=10000, ttl=60)
+_key_cache_lock = threading.Lock()
+
+# Pagination for list endpoints
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def ojson(payload, status=200):
+    """
+    jsonify() equivalent backed by orjson.
+    orjson encodes datetimes natively, so models pass them through as-is.
+    """
+    return Response(
+        orjson.dumps(payload, option=orjson.OPT_UTC_Z),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+def _resolve_api_key(api_key):
+    """
+    Resolve a raw API key to (key pk, user), or None if it is invalid.
+    Cache hits skip the key lookup and HMAC; the user is still loaded so
+    deactivation and deletion take effect immediately.
+    """
+    cache_key = hashlib.blake2b(api_key.encode('utf-8'), digest_size=16).digest()
+    with _key_cache_lock:
+        cached = _key_cache.get(cache_key)
+
+    if cached:
+        key_pk, user_id, expires_at = cached
+        if expires_at and datetime.utcnow() > expires_at:
+            return None
+        user = db.session.get(User, user_id)
+        if user:
+            return key_pk, user
+
+    # Look up the key by its public prefix, then verify the secret once
+    key_id, _, secret = api_key.partition('.')
+    if not key_id or not secret:
+        return None
+    key_obj = db.session.scalar(
+        select(ApiKey).where(ApiKey.key_id == key_id, ApiKey.is_active.is_(True)).limit(1)
+    )
+    if not key_obj or not key_obj.verify_key(secret):
+        return None
+
+    with _key_cache_lock:
+        _key_cache[cache_key] = (key_obj.id, key_obj.user_id, key_obj.expires_at)
+    return key_obj.id, key_obj.user
+
+
+def _evict_api_key(key_pk):
+    """Drop a revoked key from the resolution cache"""
+    with _key_cache_lock:
+        stale = [k for k, v in _key_cache.items() if v[0] == key_pk]
+        for k in stale:
+            _key_cache.pop(k, None)
+
 
 def api_key_required(f):
     """Decorator to require API key authentication"""
@@ -17,32 +86,26 @@ def api_key_required(f):
         api_key = request.headers.get('X-API-Key')
 
         if not api_key:
-            return jsonify({
+            return ojson({
                 'error': 'API key required',
                 'message': 'Please provide an API key in the X-API-Key header'
             }), 401
 
         # Verify API key
-        api_key_obj = ApiKey.query.filter_by(is_active=True).all()
-        authenticated = False
-        user = None
-
-        for key_obj in api_key_obj:
-            if key_obj.verify_key(api_key):
-                key_obj.record_usage()
-                user = key_obj.user
-                authenticated = True
-                break
-
-        if not authenticated:
-            return jsonify({
+        resolved = _resolve_api_key(api_key)
+
+        if not resolved:
+            return ojson({
                 'error': 'Invalid API key',
                 'message': 'The provided API key is invalid or has expired'
             }), 401
 
+        key_pk, user = resolved
+        record_usage(key_pk)
+
         # Check if user is active
         if not user.is_active:
-            return jsonify({
+            return ojson({
                 'error': 'Account deactivated',
                 'message': 'Your account has been deactivated'
             }), 403
@@ -54,18 +117,25 @@ def api_key_required(f):
     return decorated_function
 
 
+def _pagination_args():
+    """Read limit/offset query parameters, clamped to sane bounds"""
+    limit = request.args.get('limit', DEFAULT_PAGE_SIZE, type=int)
+    offset = request.args.get('offset', 0, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE)), max(0, offset)
+
+
 def admin_required(f):
     """Decorator to require admin privileges"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if not current_user.is_authenticated:
-            return jsonify({
+            return ojson({
                 'error': 'Authentication required',
                 'message': 'You must be logged in to access this resource'
             }), 401
 
         if not current_user.is_admin:
-            return jsonify({
+            return ojson({
                 'error': 'Admin access required',
                 'message': 'You do not have permission to access this resource'
             }), 403
@@ -75,37 +145,47 @@ def admin_required(f):
     return decorated_function
 
 
-# API Information
+# API Information, encoded (and gzipped) once at import
+_API_INFO_BODY = orjson.dumps({
+    'name': 'Secure Flask API',
+    'version': '1.0.0',
+    'description': 'A secure REST API with authentication and rate limiting',
+    'endpoints': {
+        'auth': {
+            'POST /api/auth/login': 'Login and get API key',
+            'GET /api/auth/me': 'Get current user info (requires API key)'
+        },
+        'users': {
+            'GET /api/users': 'List all users (admin only)',
+            'GET /api/users/<id>': 'Get user by ID (admin only)',
+            'PUT /api/users/<id>': 'Update user (admin only)',
+            'DELETE /api/users/<id>': 'Delete user (admin only)'
+        },
+        'keys': {
+            'GET /api/keys': 'List your API keys (requires login)',
+            'POST /api/keys': 'Create new API key (requires login)',
+            'DELETE /api/keys/<id>': 'Revoke API key (requires login)'
+        }
+    },
+    'rate_limits': {
+        'default': '200 per day, 50 per hour',
+        'authentication': '10 per minute'
+    }
+})
+_API_INFO_GZIP = gzip.compress(_API_INFO_BODY)
+
+
 @bp.route('/', methods=['GET'])
 @limiter.limit("100 per hour")
 def api_info():
     """API information and available endpoints"""
-    return jsonify({
-        'name': 'Secure Flask API',
-        'version': '1.0.0',
-        'description': 'A secure REST API with authentication and rate limiting',
-        'endpoints': {
-            'auth': {
-                'POST /api/auth/login': 'Login and get API key',
-                'GET /api/auth/me': 'Get current user info (requires API key)'
-            },
-            'users': {
-                'GET /api/users': 'List all users (admin only)',
-                'GET /api/users/<id>': 'Get user by ID (admin only)',
-                'PUT /api/users/<id>': 'Update user (admin only)',
-                'DELETE /api/users/<id>': 'Delete user (admin only)'
-            },
-            'keys': {
-                'GET /api/keys': 'List your API keys (requires login)',
-                'POST /api/keys': 'Create new API key (requires login)',
-                'DELETE /api/keys/<id>': 'Revoke API key (requires login)'
-            }
-        },
-        'rate_limits': {
-            'default': '200 per day, 50 per hour',
-            'authentication': '10 per minute'
-        }
-    }), 200
+    if request.accept_encodings['gzip'] > 0:  # gzip;q=0 means refused
+        response = Response(_API_INFO_GZIP, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(_API_INFO_BODY, mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    return response
 
 
 # Authentication endpoints
@@ -120,50 +200,55 @@ def api_login():
     data = request.get_json()
 
     if not data or 'username' not in data or 'password' not in data:
-        return jsonify({
+        return ojson({
             'error': 'Invalid request',
             'message': 'Username and password are required'
         }), 400
 
-    # Find user
-    user = User.query.filter(
-        (User.username == data['username']) |
-        (User.email == data['username'].lower())
-    ).first()
+    # Find user by username, then by email (each hits its own unique index)
+    username = data['username']
+    user = (
+        db.session.scalar(select(User).where(User.username == username).limit(1)) or
+        db.session.scalar(select(User).where(User.email == username.lower()).limit(1))
+    )
 
-    # Verify credentials
-    if not user or not user.check_password(data['password']):
-        return jsonify({
+    # Verify credentials; unknown users pay the same hashing cost
+    if user:
+        password_ok = user.check_password(data['password'])
+    else:
+        password_ok = User.verify_password_for_unknown_user(data['password'])
+
+    if not password_ok:
+        return ojson({
             'error': 'Authentication failed',
             'message': 'Invalid username or password'
         }), 401
 
     # Check account status
     if user.is_account_locked():
-        return jsonify({
+        return ojson({
             'error': 'Account locked',
             'message': 'Your account is temporarily locked'
         }), 403
 
     if not user.is_active:
-        return jsonify({
+        return ojson({
             'error': 'Account deactivated',
             'message': 'Your account has been deactivated'
         }), 403
 
     # Generate API key
-    api_key = secrets.token_urlsafe(32)
     api_key_obj = ApiKey(
         name=f"API Key - {data.get('device', 'Unknown')}",
         user_id=user.id
     )
-    api_key_obj.set_key(api_key)
+    api_key = api_key_obj.generate_key()
 
     db.session.add(api_key_obj)
-    user.reset_failed_logins()
+    User.reset_failed_logins_fast(user.id)
     db.session.commit()
 
-    return jsonify({
+    return ojson({
         'message': 'Authentication successful',
         'api_key': api_key,
         'user': user.to_dict(),
@@ -177,7 +262,7 @@ def api_login():
 def get_current_user():
     """Get current authenticated user information"""
     user = request.api_user
-    return jsonify({
+    return ojson({
         'user': user.to_dict(include_email=True)
     }), 200
 
@@ -187,10 +272,28 @@ def get_current_user():
 @login_required
 @limiter.limit("50 per hour")
 def list_api_keys():
-    """List all API keys for current user"""
-    keys = ApiKey.query.filter_by(user_id=current_user.id).all()
-    return jsonify({
-        'keys': [key.to_dict() for key in keys]
+    """List API keys for current user (paginated with ?limit=&offset=)"""
+    limit, offset = _pagination_args()
+    # Select plain columns instead of hydrating ORM objects
+    rows = db.session.execute(
+        select(ApiKey.id, ApiKey.name, ApiKey.is_active, ApiKey.created_at,
+               ApiKey.expires_at, ApiKey.last_used)
+        .where(ApiKey.user_id == current_user.id)
+        .order_by(ApiKey.id)
+        .limit(limit)
+        .offset(offset)
+    ).all()
+    return ojson({
+        'keys': [{
+            'id': r.id,
+            'name': r.name,
+            'is_active': r.is_active,
+            'created_at': r.created_at,
+            'expires_at': r.expires_at,
+            'last_used': r.last_used
+        } for r in rows],
+        'limit': limit,
+        'offset': offset
     }), 200
 
 
@@ -202,23 +305,22 @@ def create_api_key():
     data = request.get_json()
 
     if not data or 'name' not in data:
-        return jsonify({
+        return ojson({
             'error': 'Invalid request',
             'message': 'API key name is required'
         }), 400
 
     # Generate new API key
-    api_key = secrets.token_urlsafe(32)
     api_key_obj = ApiKey(
         name=data['name'],
         user_id=current_user.id
     )
-    api_key_obj.set_key(api_key)
+    api_key = api_key_obj.generate_key()
 
     db.session.add(api_key_obj)
     db.session.commit()
 
-    return jsonify({
+    return ojson({
         'message': 'API key created successfully',
         'api_key': api_key,
         'key_info': api_key_obj.to_dict(),
@@ -231,21 +333,21 @@ def create_api_key():
 @limiter.limit("10 per hour")
 def revoke_api_key(key_id):
     """Revoke (delete) an API key"""
-    api_key = ApiKey.query.filter_by(
-        id=key_id,
-        user_id=current_user.id
-    ).first()
+    api_key = db.session.scalar(
+        select(ApiKey).where(ApiKey.id == key_id, ApiKey.user_id == current_user.id)
+    )
 
     if not api_key:
-        return jsonify({
+        return ojson({
             'error': 'Not found',
             'message': 'API key not found'
         }), 404
 
     db.session.delete(api_key)
     db.session.commit()
+    _evict_api_key(key_id)
 
-    return jsonify({
+    return ojson({
         'message': 'API key revoked successfully'
     }), 200
 
@@ -256,11 +358,27 @@ def revoke_api_key(key_id):
 @admin_required
 @limiter.limit("100 per hour")
 def list_users():
-    """List all users (admin only)"""
-    users = User.query.all()
-    return jsonify({
-        'users': [user.to_dict() for user in users],
-        'total': len(users)
+    """List all users (admin only, paginated with ?limit=&offset=)"""
+    limit, offset = _pagination_args()
+    # Select plain columns instead of hydrating ORM objects
+    rows = db.session.execute(
+        select(User.id, User.username, User.is_admin, User.created_at, User.last_login)
+        .order_by(User.id)
+        .limit(limit)
+        .offset(offset)
+    ).all()
+    total = db.session.scalar(select(func.count()).select_from(User))
+    return ojson({
+        'users': [{
+            'id': r.id,
+            'username': r.username,
+            'is_admin': r.is_admin,
+            'created_at': r.created_at,
+            'last_login': r.last_login
+        } for r in rows],
+        'total': total,
+        'limit': limit,
+        'offset': offset
     }), 200
 
 
@@ -270,15 +388,15 @@ def list_users():
 @limiter.limit("100 per hour")
 def get_user(user_id):
     """Get user by ID (admin only)"""
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
 
     if not user:
-        return jsonify({
+        return ojson({
             'error': 'Not found',
             'message': 'User not found'
         }), 404
 
-    return jsonify({
+    return ojson({
         'user': user.to_dict(include_email=True)
     }), 200
 
@@ -289,10 +407,10 @@ def get_user(user_id):
 @limiter.limit("50 per hour")
 def update_user(user_id):
     """Update user (admin only)"""
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
 
     if not user:
-        return jsonify({
+        return ojson({
             'error': 'Not found',
             'message': 'User not found'
         }), 404
@@ -305,11 +423,11 @@ def update_user(user_id):
     if 'is_admin' in data:
         user.is_admin = data['is_admin']
     if 'email' in data:
-        user.email = data['email'].lower()
+        user.email = data['email']
 
     db.session.commit()
 
-    return jsonify({
+    return ojson({
         'message': 'User updated successfully',
         'user': user.to_dict(include_email=True)
     }), 200
@@ -323,15 +441,15 @@ def delete_user(user_id):
     """Delete user (admin only)"""
     # Prevent self-deletion
     if user_id == current_user.id:
-        return jsonify({
+        return ojson({
             'error': 'Invalid operation',
             'message': 'You cannot delete your own account'
         }), 400
 
-    user = User.query.get(user_id)
+    user = db.session.get(User, user_id)
 
     if not user:
-        return jsonify({
+        return ojson({
             'error': 'Not found',
             'message': 'User not found'
         }), 404
@@ -339,7 +457,7 @@ def delete_user(user_id):
     db.session.delete(user)
     db.session.commit()
 
-    return jsonify({
+    return ojson({
         'message': 'User deleted successfully'
     }), 200
 
@@ -347,7 +465,7 @@ def delete_user(user_id):
 # Error handlers for API
 @bp.errorhandler(400)
 def bad_request(error):
-    return jsonify({
+    return ojson({
         'error': 'Bad request',
         'message': str(error)
     }), 400
@@ -355,7 +473,7 @@ def bad_request(error):
 
 @bp.errorhandler(404)
 def not_found(error):
-    return jsonify({
+    return ojson({
         'error': 'Not found',
         'message': 'The requested resource was not found'
     }), 404
@@ -364,7 +482,7 @@ def not_found(error):
 @bp.errorhandler(500)
 def internal_error(error):
     db.session.rollback()
-    return jsonify({
+    return ojson({
         'error': 'Internal server error',
         'message': 'An unexpected error occurred'
     }), 500
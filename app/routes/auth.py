@@ -1,11 +1,44 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, current_app, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy import select
 from app import db, limiter
 from app.models import User
 from app.forms import RegistrationForm, LoginForm, ChangePasswordForm, ProfileUpdateForm
+from cachetools import TTLCache
+from datetime import datetime
+from urllib.parse import urlsplit
+import threading
 
 bp = Blueprint('auth', __name__, url_prefix='/auth')
 
+# Account locks seen by this process: login identifier -> locked_until.
+# Repeat attempts against a locked account skip the user query and hashing.
+_locked_logins = TTLCache(maxsize=8192, ttl=User.LOCKOUT_DURATION.total_seconds())
+_locked_logins_lock = threading.Lock()
+
+
+def _is_known_locked(identifier):
+    """Check the per-process lock cache for a login identifier"""
+    with _locked_logins_lock:
+        locked_until = _locked_logins.get(identifier)
+    return locked_until is not None and datetime.utcnow() < locked_until
+
+
+def _remember_lock(identifier, locked_until):
+    """Cache an observed account lock for a login identifier"""
+    with _locked_logins_lock:
+        _locked_logins[identifier] = locked_until
+
+
+def _is_safe_next(target):
+    """
+    Only allow same-site relative paths as redirect targets.
+    Browsers treat '//host' and '/\\host' as absolute URLs, so both are rejected.
+    """
+    parts = urlsplit(target.replace('\\', '/'))
+    return (not parts.scheme and not parts.netloc
+            and parts.path.startswith('/') and not parts.path.startswith('//'))
+
 
 @bp.route('/register', methods=['GET', 'POST'])
 @limiter.limit("5 per hour")  # Prevent registration spam
@@ -21,7 +54,7 @@ def register():
         # Create new user
         user = User(
             username=form.username.data,
-            email=form.email.data.lower()
+            email=form.email.data
         )
         user.set_password(form.password.data)
 
@@ -32,10 +65,10 @@ def register():
             flash('Registration successful! You can now log in.', 'success')
             return redirect(url_for('auth.login'))
 
-        except Exception as e:
+        except Exception:
             db.session.rollback()
             flash('An error occurred during registration. Please try again.', 'danger')
-            print(f'Registration error: {e}')
+            current_app.logger.exception('Registration error')
 
     return render_template('auth/register.html', form=form, title='Register')
 
@@ -51,14 +84,24 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        # Support login with username or email
-        user = User.query.filter(
-            (User.username == form.username.data) |
-            (User.email == form.username.data.lower())
-        ).first()
-
-        # Check if user exists and account is not locked
-        if user and user.is_account_locked():
+        username = form.username.data
+        user = None
+        locked = _is_known_locked(username)
+
+        if not locked:
+            # Support login with username or email; two indexed lookups
+            # instead of an OR that can defeat both indexes
+            user = (
+                db.session.scalar(select(User).where(User.username == username).limit(1)) or
+                db.session.scalar(select(User).where(User.email == username.lower()).limit(1))
+            )
+
+            # Check if user exists and account is not locked
+            if user and user.is_account_locked():
+                _remember_lock(username, user.account_locked_until)
+                locked = True
+
+        if locked:
             flash(
                 'Your account is temporarily locked due to multiple failed login attempts. '
                 'Please try again later.',
@@ -66,27 +109,34 @@ def login():
             )
             return render_template('auth/login.html', form=form, title='Login')
 
-        # Verify password
-        if user and user.check_password(form.password.data):
+        # Verify password; unknown users pay the same hashing cost
+        if user:
+            password_ok = user.check_password(form.password.data)
+        else:
+            password_ok = User.verify_password_for_unknown_user(form.password.data)
+
+        if password_ok:
             # Check if account is active
             if not user.is_active:
                 flash('Your account has been deactivated. Please contact support.', 'danger')
                 return render_template('auth/login.html', form=form, title='Login')
 
             # Reset failed login attempts and log in
-            user.reset_failed_logins()
+            User.reset_failed_logins_fast(user.id)
+            db.session.commit()
             login_user(user, remember=form.remember_me.data)
 
             # Redirect to next page or dashboard
             next_page = request.args.get('next')
-            if next_page and next_page.startswith('/'):
+            if next_page and _is_safe_next(next_page):
                 return redirect(next_page)
             return redirect(url_for('main.dashboard'))
 
         else:
             # Record failed login attempt if user exists
             if user:
-                user.record_failed_login()
+                User.record_failed_login_fast(user.id)
+                db.session.commit()
 
             flash('Invalid username/email or password.', 'danger')
 
@@ -107,17 +157,18 @@ def logout():
 def profile():
     """User profile management"""
 
-    form = ProfileUpdateForm(current_user.email)
+    # Submitted data takes precedence over obj, so this only prefills GET
+    form = ProfileUpdateForm(obj=current_user)
 
     if form.validate_on_submit():
-        current_user.email = form.email.data.lower()
-        db.session.commit()
+        new_email = form.email.data.lower()
+        # Skip the write entirely when nothing changed
+        if new_email != current_user.email:
+            current_user.email = new_email
+            db.session.commit()
         flash('Your profile has been updated successfully.', 'success')
         return redirect(url_for('auth.profile'))
 
-    elif request.method == 'GET':
-        form.email.data = current_user.email
-
     return render_template('auth/profile.html', form=form, title='Profile')
 
 
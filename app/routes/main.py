@@ -1,13 +1,51 @@
-from flask import Blueprint, render_template
+from flask import Blueprint, Response, current_app, render_template, request, session
 from flask_login import login_required, current_user
+from app import limiter
+import hashlib
 
 bp = Blueprint('main', __name__)
 
 
+def _serves_cached_page():
+    """
+    Whether a static page request is answered from the page cache.
+    Logged-in users, pending flash messages and debug mode render normally.
+    """
+    return current_user.is_anonymous and not session.get('_flashes') and not current_app.debug
+
+
+# Cached responses skip rate limiting; full renders keep the default limits
+static_page_limit = limiter.limit(
+    lambda: current_app.config['RATELIMIT_DEFAULT'],
+    exempt_when=_serves_cached_page
+)
+
+
+def _render_static_page(template, title):
+    """
+    Serve a page whose anonymous rendering never changes from a per-app
+    cache of its bytes, with an ETag for conditional requests.
+    """
+    if not _serves_cached_page():
+        return render_template(template, title=title)
+
+    cache = current_app.extensions.setdefault('static_pages', {})
+    cached = cache.get(template)
+    if cached is None:
+        body = render_template(template, title=title).encode('utf-8')
+        cached = cache[template] = (body, hashlib.sha256(body).hexdigest())
+
+    body, etag = cached
+    response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 @bp.route('/')
+@static_page_limit
 def index():
     """Homepage"""
-    return render_template('index.html', title='Home')
+    return _render_static_page('index.html', title='Home')
 
 
 @bp.route('/dashboard')
@@ -18,6 +56,7 @@ def dashboard():
 
 
 @bp.route('/about')
+@static_page_limit
 def about():
     """About page"""
-    return render_template('about.html', title='About')
+    return _render_static_page('about.html', title='About')
@@ -0,0 +1,38 @@
+"""
+In-place schema upgrades for existing databases.
+db.create_all() only creates missing tables; it never adds columns or
+indexes to tables that already exist. The repo has no migration tool, so
+additive changes are applied here, idempotently, by `flask init-admin`
+and `flask upgrade-db`.
+"""
+
+from sqlalchemy import inspect, text
+from app import db
+
+
+def upgrade_schema():
+    """
+    Add api_keys columns and indexes missing from databases created by
+    earlier releases. Returns a description of each change applied.
+    """
+    from app.models import ApiKey
+    table = ApiKey.__table__
+    inspector = inspect(db.engine)
+    if not inspector.has_table(table.name):
+        return []
+
+    applied = []
+    columns = {column['name'] for column in inspector.get_columns(table.name)}
+    with db.engine.begin() as conn:
+        if 'key_id' not in columns:
+            column_type = table.c.key_id.type.compile(dialect=conn.dialect)
+            conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN key_id {column_type}'))
+            applied.append(f'added column {table.name}.key_id')
+
+        indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                index.create(conn)
+                applied.append(f'created index {index.name}')
+
+    return applied
@@ -0,0 +1,86 @@
+"""
+Deferred API key usage tracking.
+Writing last_used on every authenticated request would cost one write
+transaction per API call, so usage is queued in-process and written in
+bulk by a background thread.
+"""
+
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+from sqlalchemy import bindparam, update
+from app import db
+
+# Wake the flusher early once this many updates are pending
+FLUSH_SIZE = 500
+
+# Pending (api_key_id, used_at) pairs
+usage_queue = deque()
+_wakeup = threading.Event()
+
+
+def record_usage(api_key_id):
+    """Queue a last_used update for an API key"""
+    usage_queue.append((api_key_id, datetime.utcnow()))
+    if len(usage_queue) >= FLUSH_SIZE:
+        _wakeup.set()
+
+
+def flush_usage():
+    """
+    Write all queued usage in a single bulk UPDATE.
+    Duplicate entries are coalesced to the latest timestamp per key.
+    Must be called inside an application context.
+    """
+    latest = {}
+    while True:
+        try:
+            api_key_id, used_at = usage_queue.popleft()
+        except IndexError:
+            break
+        if api_key_id not in latest or used_at > latest[api_key_id]:
+            latest[api_key_id] = used_at
+
+    if not latest:
+        return 0
+
+    # Core UPDATE so keys revoked since they were queued are simply skipped
+    from app.models import ApiKey
+    table = ApiKey.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.id == bindparam('key_pk'))
+        .values(last_used=bindparam('used_at')),
+        [{'key_pk': api_key_id, 'used_at': used_at} for api_key_id, used_at in latest.items()]
+    )
+    db.session.commit()
+    return len(latest)
+
+
+def init_usage_flusher(app):
+    """
+    Start the background flusher for this app.
+    API_KEY_USAGE_FLUSH_INTERVAL of 0 disables the thread; queued usage is
+    then only written by explicit flush_usage() calls and at exit.
+    """
+
+    def flush_in_context():
+        with app.app_context():
+            try:
+                flush_usage()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Failed to flush API key usage')
+
+    interval = app.config.get('API_KEY_USAGE_FLUSH_INTERVAL', 0)
+    if interval:
+        def run():
+            while True:
+                _wakeup.wait(interval)
+                _wakeup.clear()
+                flush_in_context()
+
+        threading.Thread(target=run, name='api-key-usage-flusher', daemon=True).start()
+
+    atexit.register(flush_in_context)
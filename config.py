@@ -1,9 +1,28 @@
 import os
 from datetime import timedelta
 from dotenv import load_dotenv
+from sqlalchemy.pool import StaticPool
+
+# Load environment variables from .env (set FLASK_LOAD_DOTENV=0 to skip
+# the filesystem walk when the environment is already provided)
+if os.environ.get('FLASK_LOAD_DOTENV', '1') == '1':
+    load_dotenv()
+
+
+def calibrate_bcrypt_rounds(target=0.1, ceiling=12):
+    """
+    Largest bcrypt cost (capped at ceiling) whose hash takes under target
+    seconds on this machine, measured from a single cost-10 hash.
+    Each extra round doubles the work.
+    """
+    import math
+    import time
+    import bcrypt
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibrate', bcrypt.gensalt(10))
+    elapsed = time.perf_counter() - start
+    return max(4, min(ceiling, 10 + math.floor(math.log2(target / elapsed))))
 
-# Load environment variables
-load_dotenv()
 
 class Config:
     """Base configuration with secure defaults"""
@@ -16,9 +35,13 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(os.path.abspath(os.path.dirname(__file__)), 'instance', 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    AUTO_CREATE_TABLES = False  # Run db.create_all() in create_app
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_pre_ping': True,  # Verify connections before using them
-        'pool_recycle': 3600,   # Recycle connections after 1 hour
+        'pool_recycle': 300,    # Recycle connections before server/proxy idle timeouts
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', max((os.cpu_count() or 1) * 2, 5))),
+        'max_overflow': int(os.environ.get('DB_POOL_OVERFLOW', 10)),
+        'pool_use_lifo': True,  # Reuse the hottest connection; idle extras time out
     }
 
     # Session configuration (security)
@@ -32,14 +55,35 @@ class Config:
     WTF_CSRF_TIME_LIMIT = None  # No time limit on CSRF tokens
     WTF_CSRF_SSL_STRICT = True  # Require referrer for HTTPS
 
-    # Bcrypt configuration
-    BCRYPT_LOG_ROUNDS = 12  # Cost factor for password hashing
+    # API key hashing: HMAC pepper kept outside the database
+    API_KEY_PEPPER = os.environ.get('API_KEY_PEPPER') or SECRET_KEY
+
+    # Seconds between bulk writes of API key last_used timestamps
+    API_KEY_USAGE_FLUSH_INTERVAL = 10
+
+    # Password hashing: 'argon2' (Argon2id) or 'bcrypt'. Existing bcrypt
+    # hashes are still accepted and upgraded to Argon2id on login.
+    PASSWORD_HASH_SCHEME = os.environ.get('PASSWORD_HASH_SCHEME', 'argon2')
+    ARGON2_TIME_COST = 2
+    ARGON2_MEMORY_COST = 65536  # KiB
+    ARGON2_PARALLELISM = 1
+
+    # Bcrypt configuration (used when PASSWORD_HASH_SCHEME is 'bcrypt')
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))  # Cost factor for password hashing
 
     # Rate limiting
+    # Shared Redis storage so limits hold across gunicorn workers and hosts;
+    # fixed-window is O(1) per hit (moving-window is O(limit))
+    REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
     RATELIMIT_ENABLED = True
-    RATELIMIT_STORAGE_URL = "memory://"
+    RATELIMIT_STORAGE_URI = REDIS_URL
+    RATELIMIT_STORAGE_OPTIONS = {
+        # Bounded per-process Redis pool to avoid reconnect storms
+        'max_connections': int(os.environ.get('REDIS_MAX_CONNECTIONS', 16)),
+    }
     RATELIMIT_STRATEGY = "fixed-window"
-    RATELIMIT_DEFAULT = "200 per day, 50 per hour"
+    RATELIMIT_IN_MEMORY_FALLBACK_ENABLED = True  # Per-process limits while Redis is down
+    RATELIMIT_DEFAULT = "200 per day, 50 per hour"  # Replaced by per-route limits where set
 
     # Security headers (Flask-Talisman)
     TALISMAN_FORCE_HTTPS = True
@@ -79,13 +123,29 @@ class Config:
     REQUIRE_PASSWORD_DIGIT = True
     REQUIRE_PASSWORD_SPECIAL = True
 
+    @classmethod
+    def init_app(cls, app):
+        """Configuration-specific app setup, called by create_app"""
+        pass
+
 
 class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
+    AUTO_CREATE_TABLES = True
+    RATELIMIT_STORAGE_URI = os.environ.get('REDIS_URL') or 'memory://'
     SESSION_COOKIE_SECURE = False  # Allow HTTP in development
     TALISMAN_FORCE_HTTPS = False
 
+    @classmethod
+    def init_app(cls, app):
+        Config.init_app(app)
+
+        # Keep local logins snappy unless a cost is set explicitly; the cost
+        # only matters when new hashes use bcrypt
+        if app.config['PASSWORD_HASH_SCHEME'] == 'bcrypt' and 'BCRYPT_LOG_ROUNDS' not in os.environ:
+            app.config['BCRYPT_LOG_ROUNDS'] = calibrate_bcrypt_rounds()
+
 
 class ProductionConfig(Config):
     """Production configuration"""
@@ -97,22 +157,46 @@ class ProductionConfig(Config):
     def init_app(cls, app):
         Config.init_app(app)
 
-        # Log to stderr
+        # Log to stderr from a background thread so request threads never
+        # block on log I/O
+        import atexit
         import logging
+        import queue
         from logging import StreamHandler
+        from logging.handlers import QueueHandler, QueueListener
+        from flask.logging import default_handler
         file_handler = StreamHandler()
         file_handler.setLevel(logging.WARNING)
-        app.logger.addHandler(file_handler)
+        file_handler.setFormatter(default_handler.formatter)
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        app.logger.removeHandler(default_handler)
+        app.logger.addHandler(QueueHandler(log_queue))
 
 
 class TestingConfig(Config):
     """Testing configuration"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    # One shared connection so every session sees the same in-memory database
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False},
+    }
+    AUTO_CREATE_TABLES = True
+    RATELIMIT_STORAGE_URI = 'memory://'
+    API_KEY_USAGE_FLUSH_INTERVAL = 0  # Flush explicitly with app.usage.flush_usage()
     WTF_CSRF_ENABLED = False
     SESSION_COOKIE_SECURE = False
     TALISMAN_FORCE_HTTPS = False
 
+    # Minimum hashing costs; password strength is not under test
+    BCRYPT_LOG_ROUNDS = 4
+    ARGON2_TIME_COST = 1
+    ARGON2_MEMORY_COST = 8  # KiB, the Argon2 minimum
+
 
 # Configuration dictionary
 config = {
@@ -49,7 +49,7 @@ ssh ${SERVER_USER}@${SERVER_IP} -p ${SERVER_PORT} << 'ENDSSH'
     apt-get update -y
 
     # Install required packages
-    apt-get install -y python3 python3-pip python3-venv nginx git supervisor
+    apt-get install -y python3 python3-pip python3-venv nginx git supervisor redis-server
 
     echo "System packages installed successfully"
 ENDSSH
@@ -114,13 +114,7 @@ ssh ${SERVER_USER}@${SERVER_IP} -p ${SERVER_PORT} << ENDSSH
     cd ${DEPLOY_DIR}/${APP_NAME}
     source venv/bin/activate
     export FLASK_ENV=production
-    python3 << 'PYTHON'
-from app import create_app, db
-app = create_app('production')
-with app.app_context():
-    db.create_all()
-    print("Database initialized successfully")
-PYTHON
+    flask --app run.py init-admin
 ENDSSH
 echo -e "${GREEN}✓ Database initialized${NC}"
 
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """
 Main entry point for the Flask application.
-Run this file to start the development server.
+Run this file to start a multi-threaded Waitress server.
+Set FLASK_ENV=development and FLASK_USE_RELOADER=1 for the Werkzeug
+development server with the debugger and auto-reload.
 """
 
 import os
@@ -12,23 +14,11 @@ app = create_app(os.environ.get('FLASK_ENV', 'development'))
 
 if __name__ == '__main__':
     # Get configuration from environment
-    debug = os.environ.get('FLASK_ENV') == 'development'
     host = os.environ.get('FLASK_HOST', '127.0.0.1')
     port = int(os.environ.get('FLASK_PORT', 5000))
 
-    print(f"""
-╔═══════════════════════════════════════════════════════════╗
-║          Secure Flask API                                 ║
-║                                                           ║
-║  Server running at: http://{host}:{port}           ║
-║  Environment: {os.environ.get('FLASK_ENV', 'development').ljust(44)}║
-║                                                           ║
-║  Press CTRL+C to quit                                     ║
-╚═══════════════════════════════════════════════════════════╝
-    """)
-
-    app.run(
-        host=host,
-        port=port,
-        debug=debug
-    )
+    if os.environ.get('FLASK_ENV') == 'development' and os.environ.get('FLASK_USE_RELOADER') == '1':
+        app.run(host=host, port=port, debug=True)
+    else:
+        from waitress import serve
+        serve(app, host=host, port=port, threads=int(os.environ.get('FLASK_THREADS', 8)))